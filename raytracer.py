@@ -1,34 +1,354 @@
 # Import from local library
+import math
 from argparse import ArgumentParser
 
 # Import 3rd party library
 import numpy as np
 
+# Import optional 3rd party library, renders fall back to NumPy without it
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+# Import optional 3rd party library, needed for rendering on the GPU
+try:
+    import cupy
+    CUPY_AVAILABLE = True
+except ImportError:
+    CUPY_AVAILABLE = False
+
+
+def _array_module(*arrays):
+    """NumPy or CuPy, whichever holds the arrays"""
+    return cupy.get_array_module(*arrays) if CUPY_AVAILABLE else np
+
+
+# Fast math flags for the kernels, without 'nnan' and 'ninf' because misses are np.inf
+_FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+# Batched helpers over arrays of shape (..., 3)
+def _normalize(v):
+    return v / _array_module(v).linalg.norm(v, axis=-1, keepdims=True)
+
+
+# Exponents from this on are raised with **, repeated squaring would overflow int64
+_MAX_INT_EXPONENT = 2**31
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _is_int_exponent(k):
+    """Tells if k is a non-negative integer small enough to be raised by repeated squaring"""
+    return 0 <= k < _MAX_INT_EXPONENT and k == np.floor(k)
+
+
+def _power(x, k):
+    """Raises x to k, by repeated squaring when k is a small non-negative integer"""
+    if not _is_int_exponent(k):
+        return x ** k
+
+    result, base, k = _array_module(x).ones_like(x), x, int(k)
+    while k:
+        if k & 1:
+            result *= base
+        k >>= 1
+        if k:
+            base = base * base
+
+    return result
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _ipow(x, k):
+    """Raises x to a non-negative integer k by repeated squaring"""
+    y = 1.0
+    while k:
+        if k & 1:
+            y *= x
+        x *= x
+        k >>= 1
+
+    return y
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _nearest_root(a, b, c):
+    """Smallest root t of a*t**2 + b*t + c, np.inf if it is complex or negative"""
+    d = b*b - 4*a*c
+    if d >= 0:
+        t = (-b - np.sqrt(d)) / (2*a)
+        if t >= 0:
+            return t
+
+    return np.inf
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _screen(W, H):
+    """Corner and steps between pixels of a W x H screen at z = 0, as (x0, x_step, y0, y_step)"""
+    ratio = W / H
+    return -1.0, 2.0 / (W-1), -1/ratio, 2/ratio / (H-1)
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _ray_direction(cam, screen, i, j):
+    """Direction of the ray from the camera through pixel (i, j) and its squared norm"""
+    x0, x_step, y0, y_step = screen
+    dx = x0 + i*x_step - cam[0]
+    dy = y0 + j*y_step - cam[1]
+    dz = -cam[2]
+
+    return dx, dy, dz, dx*dx + dy*dy + dz*dz
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _sphere_offset(cam, centers, radii, sphere):
+    """Vector from the center of a sphere to the camera and its squared norm minus the squared radius"""
+    ox = cam[0] - centers[sphere, 0]
+    oy = cam[1] - centers[sphere, 1]
+    oz = cam[2] - centers[sphere, 2]
+
+    return ox, oy, oz, ox*ox + oy*oy + oz*oz - radii[sphere]**2
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _background(out, j, i, dy, a, bg_top, bg_bottom):
+    """Writes into pixel (i, j) the background gradient seen by a ray missing every sphere"""
+    t = dy / np.sqrt(a)
+    for ch in range(3):
+        out[j, i, ch] = t*bg_top[ch] + (1-t)*bg_bottom[ch]
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _ambient_color(hit, mat_color, mat_amb):
+    """Ambient color of the sphere hit, lit or not"""
+    return (mat_color[hit, 0] * mat_amb[hit],
+            mat_color[hit, 1] * mat_amb[hit],
+            mat_color[hit, 2] * mat_amb[hit])
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _hit_frame(cam, dx, dy, dz, dist, centers, radii, hit):
+    """Point hit at dist along the ray, unit normal at it and unit direction to the camera"""
+    px = cam[0] + dist*dx
+    py = cam[1] + dist*dy
+    pz = cam[2] + dist*dz
+
+    # Points hit are exactly a radius away from the center, no need for a norm
+    inv_r = 1.0 / radii[hit]
+    nx = (px - centers[hit, 0]) * inv_r
+    ny = (py - centers[hit, 1]) * inv_r
+    nz = (pz - centers[hit, 2]) * inv_r
+
+    cx, cy, cz = cam[0] - px, cam[1] - py, cam[2] - pz
+    c_norm = np.sqrt(cx*cx + cy*cy + cz*cz)
+
+    return (px, py, pz), (nx, ny, nz), (cx/c_norm, cy/c_norm, cz/c_norm)
+
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _light_color(point, normal, to_cam, hit, light, k, int_k,
+                 mat_color, mat_diff, mat_spec, light_pos, light_col):
+    """Color added by one light at a point hit, int_k tells if the exponent k is a non-negative integer"""
+    px, py, pz = point
+    nx, ny, nz = normal
+    cx, cy, cz = to_cam
+
+    lx = light_pos[light, 0] - px
+    ly = light_pos[light, 1] - py
+    lz = light_pos[light, 2] - pz
+    l_norm = np.sqrt(lx*lx + ly*ly + lz*lz)
+    lx, ly, lz = lx/l_norm, ly/l_norm, lz/l_norm
+
+    # Diffuse shading (Lambert)
+    diffuse = mat_diff[hit] * max(0.0, nx*lx + ny*ly + nz*lz)
+
+    # Specular shading (Blinn-Phong), integer exponents are raised by repeated squaring
+    hx, hy, hz = lx + cx, ly + cy, lz + cz
+    h_norm = np.sqrt(hx*hx + hy*hy + hz*hz)
+    cos_h = max(0.0, (nx*hx + ny*hy + nz*hz) / h_norm)
+    specular = mat_spec[hit] * (_ipow(cos_h, int(k)) if int_k else cos_h**k)
+
+    return (mat_color[hit, 0]*diffuse + light_col[light, 0]*specular,
+            mat_color[hit, 1]*diffuse + light_col[light, 1]*specular,
+            mat_color[hit, 2]*diffuse + light_col[light, 2]*specular)
+
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _render_kernel(cam, centers, radii, mat_color, mat_amb, mat_diff, mat_spec, mat_k,
+                   light_pos, light_col, bg_top, bg_bottom, W, H, out):
+    """Traces every pixel of a W x H image into out, one row per thread"""
+    screen = _screen(W, H)
+
+    for j in prange(H):
+        for i in range(W):
+            # Ray from the camera through the pixel
+            dx, dy, dz, a = _ray_direction(cam, screen, i, j)
+
+            # Find the nearest sphere hit by the ray
+            dist_min, hit = np.inf, -1
+            for sphere in range(len(radii)):
+                ox, oy, oz, c = _sphere_offset(cam, centers, radii, sphere)
+                t = _nearest_root(a, 2 * (ox*dx + oy*dy + oz*dz), c)
+                if t < dist_min:
+                    dist_min, hit = t, sphere
+
+            if hit < 0:
+                _background(out, j, i, dy, a, bg_top, bg_bottom)
+                continue
+
+            point, normal, to_cam = _hit_frame(cam, dx, dy, dz, dist_min, centers, radii, hit)
+            k = mat_k[hit]
+            int_k = _is_int_exponent(k)
+
+            r, g, bl = _ambient_color(hit, mat_color, mat_amb)
+
+            for light in range(len(light_pos)):
+                dr, dg, db = _light_color(point, normal, to_cam, hit, light, k, int_k,
+                                          mat_color, mat_diff, mat_spec, light_pos, light_col)
+                r, g, bl = r + dr, g + dg, bl + db
+
+            out[j, i, 0], out[j, i, 1], out[j, i, 2] = r, g, bl
+
+
+# Scenes up to this size can get a kernel with their sphere and light loops unrolled, its
+# compile time grows with both counts and is about 2.5 s at this limit
+_MAX_UNROLLED_SPHERES = 8
+_MAX_UNROLLED_LIGHTS = 4
+
+# Cached helpers the specialized kernels call, shared with _render_kernel
+_KERNEL_HELPERS = (_is_int_exponent, _screen, _ray_direction, _sphere_offset, _nearest_root,
+                   _background, _ambient_color, _hit_frame, _light_color)
+
+# Compiled specialized kernels, keyed by number of spheres, lights and specular exponent
+_KERNELS = {}
+
+# _render_kernel with its loops replaced by per-scene placeholders, see _kernel_source
+_KERNEL_TEMPLATE = '''
+@njit(parallel=True, fastmath=_FASTMATH)
+def kernel(cam, centers, radii, mat_color, mat_amb, mat_diff, mat_spec, mat_k,
+           light_pos, light_col, bg_top, bg_bottom, W, H, out):
+    screen = _screen(W, H)
+{setup}
+
+    for j in prange(H):
+        for i in range(W):
+            dx, dy, dz, a = _ray_direction(cam, screen, i, j)
+
+            dist_min, hit = np.inf, -1
+{spheres}
+
+            if hit < 0:
+                _background(out, j, i, dy, a, bg_top, bg_bottom)
+                continue
+
+            point, normal, to_cam = _hit_frame(cam, dx, dy, dz, dist_min, centers, radii, hit)
+{exponent}
+
+            r, g, bl = _ambient_color(hit, mat_color, mat_amb)
+{lights}
+
+            out[j, i, 0], out[j, i, 1], out[j, i, 2] = r, g, bl
+'''
+
+# The camera to center vectors and squared radii do not depend on the pixel
+_SPHERE_SETUP = '''
+    ox{n}, oy{n}, oz{n}, c{n} = _sphere_offset(cam, centers, radii, {n})'''
+
+_SPHERE_TEST = '''
+            t = _nearest_root(a, 2 * (ox{n}*dx + oy{n}*dy + oz{n}*dz), c{n})
+            if t < dist_min:
+                dist_min, hit = t, {n}'''
+
+_LIGHT_SHADE = '''
+            dr, dg, db = _light_color(point, normal, to_cam, hit, {n}, k, int_k,
+                                      mat_color, mat_diff, mat_spec, light_pos, light_col)
+            r, g, bl = r + dr, g + dg, bl + db'''
+
+
+def _kernel_source(n_spheres, n_lights, specular_k):
+    """Source of a render kernel unrolled for the given scene size
+
+    specular_k is the exponent shared by every material, or None if they differ.
+    """
+    # A shared exponent is baked in, so the compiler can drop the unused power branch
+    if specular_k is None:
+        exponent = '''
+            k = mat_k[hit]
+            int_k = _is_int_exponent(k)'''
+    else:
+        # repr of a non-finite float is inf or nan, names only defined under np
+        literal = repr(float(specular_k)).replace('inf', 'np.inf').replace('nan', 'np.nan')
+        exponent = f'''
+            k = {literal}
+            int_k = {_is_int_exponent(specular_k)}'''
+
+    setup = ''.join(_SPHERE_SETUP.format(n=n) for n in range(n_spheres))
+    spheres = ''.join(_SPHERE_TEST.format(n=n) for n in range(n_spheres))
+    lights = ''.join(_LIGHT_SHADE.format(n=n) for n in range(n_lights))
+
+    return _KERNEL_TEMPLATE.format(setup=setup, spheres=spheres, exponent=exponent, lights=lights)
+
+
+def _specialized_kernel(n_spheres, n_lights, specular_k):
+    """Compiles, once per key, a drop-in replacement for _render_kernel with its loops unrolled"""
+    key = (n_spheres, n_lights, None if specular_k is None else float(specular_k))
+
+    if key not in _KERNELS:
+        namespace = {'np': np, 'njit': njit, 'prange': prange, '_FASTMATH': _FASTMATH}
+        namespace.update({helper.__name__: helper for helper in _KERNEL_HELPERS})
+        exec(_kernel_source(*key), namespace)
+        _KERNELS[key] = namespace['kernel']
+
+    return _KERNELS[key]
+
 
 class Vector:
     """A three element vector used in 3D graphics"""
 
-    def __init__(self, xyz=[0.0, 0.0, 0.0]):
-        self.xyz = np.array(xyz)
-        self.x, self.y, self.z = xyz
+    __slots__ = ('xyz',)
+
+    def __init__(self, xyz=(0.0, 0.0, 0.0)):
+        if isinstance(xyz, np.ndarray):
+            self.xyz = xyz
+        else:
+            self.xyz = np.asarray(xyz, dtype=np.float64)
+
+    @property
+    def x(self):
+        return self.xyz[0]
+
+    @property
+    def y(self):
+        return self.xyz[1]
+
+    @property
+    def z(self):
+        return self.xyz[2]
 
     def __add__(self, other):
-        try:
-            return Vector(self.xyz + other.xyz)
-        except:
+        if isinstance(other, Vector):
+            return Vector.from_array(self.xyz + other.xyz)
+        else:
             return NotImplemented
 
     def __sub__(self, other):
-        try:
-            return Vector(self.xyz - other.xyz)
-        except:
+        if isinstance(other, Vector):
+            return Vector.from_array(self.xyz - other.xyz)
+        else:
             return NotImplemented
 
     def __mul__(self, other):
         if isinstance(other, Vector):
-            return Vector(self.xyz * other.xyz)
+            return Vector.from_array(self.xyz * other.xyz)
         elif isinstance(other, (int, float)):
-            return Vector(self.xyz * other)
+            return Vector.from_array(self.xyz * other)
         else:
             return NotImplemented
 
@@ -36,7 +356,7 @@ class Vector:
         return self.__mul__(other)
 
     def __truediv__(self, scalar):
-        return Vector(self.xyz / scalar)
+        return Vector.from_array(self.xyz / scalar)
 
     def __getitem__(self, index):
         return self.xyz[index]
@@ -57,22 +377,36 @@ class Vector:
         return np.dot(self.xyz, other.xyz)
 
     def cross(self, other):
-        return Vector(np.cross(self.xyz, other.xyz))
+        # Explicit formula, np.cross is slow on a single pair of 3-vectors
+        ax, ay, az = self.xyz
+        bx, by, bz = other.xyz
+
+        return Vector.from_array(np.array([ay*bz - az*by, az*bx - ax*bz, ax*by - ay*bx]))
 
     def norm(self):
-        return np.linalg.norm(self.xyz)
+        return math.sqrt(self.squared_norm())
 
     def squared_norm(self):
         return np.dot(self.xyz, self.xyz)
 
     def normalize(self):
-        return self / self.norm()
+        return Vector.from_array(self.xyz / math.sqrt(self.squared_norm()))
+
+    @classmethod
+    def from_array(cls, xyz):
+        """Wraps an existing array without copying it"""
+        vector = cls.__new__(cls)
+        vector.xyz = xyz
+
+        return vector
 
 
 class Point(Vector):
     """An alias for Vector"""
 
-    def __init__(self, xyz=[0.0, 0.0, 0.0]):
+    __slots__ = ()
+
+    def __init__(self, xyz=(0.0, 0.0, 0.0)):
         super().__init__(xyz)
 
     def __repr__(self):
@@ -108,23 +442,25 @@ class Sphere:
         self.material = material
 
     def intersect(self, ray):
-        # Auxiliary vector for cleaner code
-        center_to_origin = ray.origin - self.center
+        # Unpack the components as Python floats, plain scalar math beats NumPy on 3-vectors
+        dx, dy, dz = ray.direction.xyz.tolist()
+        ox, oy, oz = (ray.origin.xyz - self.center.xyz).tolist()
 
         # Find the coefficients for the quadratic equation
-        a = ray.direction.squared_norm()
-        b = 2 * center_to_origin @ ray.direction
-        c = center_to_origin.squared_norm() - self.radius**2
+        a = dx*dx + dy*dy + dz*dz
+        b = 2 * (ox*dx + oy*dy + oz*dz)
+        c = ox*ox + oy*oy + oz*oz - self.radius*self.radius
         # Find the discriminant
-        d = b**2 - 4*a*c
+        d = b*b - 4*a*c
 
-        if d >= 0 and (t := (-b - d**0.5) / (2*a)) >= 0:
+        if d >= 0 and (t := (-b - math.sqrt(d)) * (0.5/a)) >= 0:
             return t
         else:
             return None
 
     def normal_at(self, point_on_sphere):
-        return (point_on_sphere - self.center).normalize()
+        v = point_on_sphere.xyz - self.center.xyz
+        return Vector.from_array(v * (1.0/math.sqrt(v @ v)))
 
 
 class Light:
@@ -138,19 +474,35 @@ class Light:
 class Color:
     """Simple color class"""
 
-    def __init__(self, rgb=[0.0, 0.0, 0.0]):
-        self.rgb = np.array(rgb)
-        self.r, self.g, self.b = rgb
+    __slots__ = ('rgb',)
+
+    def __init__(self, rgb=(0.0, 0.0, 0.0)):
+        if isinstance(rgb, np.ndarray):
+            self.rgb = rgb
+        else:
+            self.rgb = np.asarray(rgb, dtype=np.float64)
+
+    @property
+    def r(self):
+        return self.rgb[0]
+
+    @property
+    def g(self):
+        return self.rgb[1]
+
+    @property
+    def b(self):
+        return self.rgb[2]
 
     def __add__(self, other):
-        try:
-            return Color(self.rgb + other.rgb)
-        except:
+        if isinstance(other, Color):
+            return Color.from_array(self.rgb + other.rgb)
+        else:
             return NotImplemented
 
     def __mul__(self, other):
         if isinstance(other, (int, float)):
-            return Color(self.rgb * other)
+            return Color.from_array(self.rgb * other)
         else:
             return NotImplemented
 
@@ -163,13 +515,21 @@ class Color:
     def __repr__(self):
         return f'Color([{self.r}, {self.g}, {self.b}])'
 
+    @classmethod
+    def from_array(cls, rgb):
+        """Wraps an existing array without copying it"""
+        color = cls.__new__(cls)
+        color.rgb = rgb
+
+        return color
+
     @classmethod
     def from_hex(cls, hexcolor="#000000"):
         r = int(hexcolor[1:3], 16) / 255
         g = int(hexcolor[3:5], 16) / 255
         b = int(hexcolor[5:7], 16) / 255
 
-        return cls([r, g, b])
+        return cls.from_array(np.array([r, g, b], dtype=np.float64))
 
 
 class Material:
@@ -190,6 +550,9 @@ class Scene:
         self.camera = None
         self.objects = []
         self.lights = []
+        # Camera rays and their background of the last view rendered, keyed by
+        # image size, camera position and backend
+        self._ray_cache = {}
 
     def set_camera(self, camera):
         self.camera = camera
@@ -200,70 +563,197 @@ class Scene:
     def add_lights(self, *lights):
         self.lights.extend(lights)
 
-    def render(self, width, height):
-        ratio = width / height
-
-        x0, x1 = -1, +1
-        x_step = (x1-x0) / (width-1)
-
-        y0, y1 = -1/ratio, +1/ratio
-        y_step = (y1-y0) / (height-1)
-
+    def _compile(self, xp=np):
+        """Packs the camera, objects and lights into contiguous arrays of xp (NumPy or CuPy)"""
+        def pack(values, width=None):
+            """Stacks values into a float array, of shape (n,) or (n, width)"""
+            array = np.array(values, dtype=float)
+            return xp.asarray(array if width is None else array.reshape(-1, width))
+
+        spheres, lights = self.objects, self.lights
+        materials = [sphere.material for sphere in spheres]
+
+        self.camera_position = pack(self.camera.xyz)
+        self.sphere_centers = pack([sphere.center.xyz for sphere in spheres], 3)
+        self.sphere_radii = pack([sphere.radius for sphere in spheres])
+        self.sphere_colors = pack([material.color.rgb for material in materials], 3)
+        self.sphere_ambient = pack([material.ambient for material in materials])
+        self.sphere_diffuse = pack([material.diffuse for material in materials])
+        self.sphere_specular = pack([material.specular for material in materials])
+        self.sphere_specular_k = pack([material.specular_k for material in materials])
+        # A single exponent for the whole scene lets the shading use repeated squaring
+        exponents = np.unique([material.specular_k for material in materials])
+        self.specular_k = float(exponents[0]) if len(exponents) == 1 else None
+
+        self.light_positions = pack([light.position.xyz for light in lights], 3)
+        self.light_colors = pack([light.color.rgb for light in lights], 3)
+
+    def render(self, width, height, backend=None):
+        """Renders the scene into a width x height Image
+
+        backend is 'numba', the default when it is installed, 'numpy' or 'cupy' to render on the GPU.
+        'numba-specialized' unrolls the kernel for small scenes: it can be faster for big images or
+        many frames, but its kernel is compiled again in every process, once per scene size.
+        """
+        if backend is None:
+            backend = 'numba' if NUMBA_AVAILABLE else 'numpy'
+
+        numba_backend = backend in ('numba', 'numba-specialized')
+        if not numba_backend and backend not in ('numpy', 'cupy'):
+            raise ValueError(f'Unknown backend {backend}.')
+        elif numba_backend and not NUMBA_AVAILABLE or backend == 'cupy' and not CUPY_AVAILABLE:
+            raise ValueError(f'Backend {backend} is not installed.')
+
+        xp = cupy if backend == 'cupy' else np
+        self._compile(xp)
         image = Image(width, height)
 
-        for j in range(height):
-            y = y0 + j*y_step
-            for i in range(width):
-                x = x0 + i*x_step
-                ray = Ray.from_points(self.camera, Point([x, y, 0]))
-                image.set_pixel(i, j, self.trace(ray))
-
-        return image
-
-    def trace(self, ray):
-        # Find the nearest object hit by the ray in the scene
-        point_hit, object_hit = self.find_nearest(ray)
-        color = self.color_at(ray, point_hit, object_hit) if object_hit else ray.bg_color()
-
-        return color
-
-    def find_nearest(self, ray):
-        dist_min, object_hit = None, None
+        if numba_backend:
+            n_spheres, n_lights = len(self.objects), len(self.lights)
+            if (backend == 'numba-specialized'
+                    and n_spheres <= _MAX_UNROLLED_SPHERES and n_lights <= _MAX_UNROLLED_LIGHTS):
+                kernel = _specialized_kernel(n_spheres, n_lights, self.specular_k)
+            else:
+                kernel = _render_kernel
+
+            colors = np.empty((height, width, 3), dtype=np.float32)
+            kernel(
+                self.camera_position,
+                self.sphere_centers, self.sphere_radii,
+                self.sphere_colors, self.sphere_ambient, self.sphere_diffuse,
+                self.sphere_specular, self.sphere_specular_k,
+                self.light_positions, self.light_colors,
+                WHITE.rgb, BLACK.rgb,
+                width, height, colors
+            )
+        else:
+            key = (width, height, tuple(self.camera.xyz), backend)
+            if key not in self._ray_cache:
+                # Only the last view is kept, a moving camera never comes back to an old one
+                origins, directions = self.camera_rays(width, height, xp)
+                self._ray_cache = {key: (origins, directions, self.bg_color(directions))}
 
-        for _object in self.objects:
-            dist = _object.intersect(ray)
-            if dist is not None and (object_hit is None or dist < dist_min):
-                dist_min, object_hit = dist, _object
+            origins, directions, background = self._ray_cache[key]
+            colors = self.trace(origins, directions, background).reshape(height, width, 3)
 
-        point_hit = ray.point_at(dist_min) if object_hit else None
+        image.set_pixels(colors)
 
-        return point_hit, object_hit
+        return image
 
-    def color_at(self, ray, point_hit, object_hit):
-        normal = object_hit.normal_at(point_hit)
-        material = object_hit.material
-        to_cam = self.camera - point_hit
+    def camera_rays(self, width, height, xp=np):
+        """Rays from the camera through every pixel, as (width*height, 3) arrays of xp"""
+        camera = xp.asarray(self.camera.xyz, dtype=float)
+        ratio = width / height
 
-        for light in self.lights:
-            to_light = Ray.from_points(point_hit, light.position)
+        x0, x1 = -1, +1
+        x_step = (x1-x0) / (width-1)
 
-            # Diffuse shading (Lambert)
-            color = (
-                material.color
-                * material.diffuse
-                * max(0, normal @ to_light.direction)
-            )
+        y0, y1 = -1/ratio, +1/ratio
+        y_step = (y1-y0) / (height-1)
 
-            # Specular shading (Blinn-Phong)
-            half_vector = (to_light.direction + to_cam).normalize()
-            color += (
-                light.color
-                * material.specular
-                * max(0, normal @ half_vector) ** material.specular_k
-            )
+        # Build the point on the screen of every pixel at once
+        ys, xs = xp.mgrid[0:height, 0:width]
+        targets = xp.empty((height, width, 3))
+        targets[..., 0] = x0 + xs*x_step
+        targets[..., 1] = y0 + ys*y_step
+        targets[..., 2] = 0
+        targets = targets.reshape(-1, 3)
+
+        # Every ray goes from the camera through its pixel
+        origins = xp.broadcast_to(camera, targets.shape)
+        directions = targets - camera
+
+        return origins, directions
+
+    def trace(self, origins, directions, background=None):
+        """Traces a batch of rays given as (P, 3) arrays into (P, 3) float32 colors
+
+        background optionally holds the precomputed (P, 3) background colors of the rays.
+        """
+        if background is None:
+            background = self.bg_color(directions)
+
+        # Find the nearest object hit by each ray in the scene
+        dist_min, object_index = self.find_nearest(origins, directions)
+
+        # Rays missing every object keep the background color
+        colors = background.astype(np.float32)
+        hit = object_index >= 0
+        points_hit = origins[hit] + dist_min[hit][:, None] * directions[hit]
+        colors[hit] = self.color_at(points_hit, object_index[hit])
+
+        return colors
+
+    def find_nearest(self, origins, directions):
+        xp = _array_module(directions)
+        if not self.objects:
+            return xp.full(len(directions), np.inf), xp.full(len(directions), -1)
+
+        dist = self._intersect_all(origins, directions)
+
+        # Keep the nearest sphere of each ray, -1 if it hits none
+        object_index = dist.argmin(axis=1)
+        dist_min = dist[xp.arange(len(dist)), object_index]
+        hit_mask = xp.isfinite(dist_min)
+        object_index[~hit_mask] = -1
+
+        return dist_min, object_index
+
+    def _intersect_all(self, origins, directions):
+        """Intersects P rays with the N spheres at once, giving (P, N) distances, np.inf means a miss"""
+        xp = _array_module(directions)
+        center_to_origin = origins[:, None, :] - self.sphere_centers[None, :, :]
+
+        # Find the coefficients of all the quadratic equations without branching
+        a = xp.einsum('pi,pi->p', directions, directions)[:, None]
+        b = 2 * xp.einsum('pni,pi->pn', center_to_origin, directions)
+        c = xp.einsum('pni,pni->pn', center_to_origin, center_to_origin) - self.sphere_radii[None, :]**2
+        d = b*b - 4*a*c
+
+        dist = xp.where(d >= 0, (-b - xp.sqrt(xp.maximum(d, 0))) / (2*a), np.inf)
+        return xp.where(dist >= 0, dist, np.inf)
+
+    def color_at(self, points_hit, object_index):
+        xp = _array_module(points_hit)
+
+        # Points hit are exactly a radius away from the center, no need for a norm
+        centers = self.sphere_centers[object_index]
+        normals = (points_hit - centers) / self.sphere_radii[object_index][:, None]
+        to_cam = _normalize(self.camera_position - points_hit)
+
+        # Material of the object hit at each point
+        material_color = self.sphere_colors[object_index]
+        ambient = self.sphere_ambient[object_index][:, None]
+        diffuse = self.sphere_diffuse[object_index][:, None]
+        specular = self.sphere_specular[object_index][:, None]
+
+        # Directions from every point to every light, shaded all at once as (P, L)
+        to_lights = _normalize(self.light_positions[None, :, :] - points_hit[:, None, :])
+
+        # Ambient shading, lit or not
+        color = material_color * ambient
+
+        # Diffuse shading (Lambert)
+        lambert = xp.maximum(0, xp.einsum('pi,pli->pl', normals, to_lights))
+        color += material_color * diffuse * lambert.sum(axis=1)[:, None]
+
+        # Specular shading (Blinn-Phong)
+        half_vectors = _normalize(to_lights + to_cam[:, None, :])
+        blinn = xp.maximum(0, xp.einsum('pi,pli->pl', normals, half_vectors))
+        if self.specular_k is not None:
+            blinn = _power(blinn, self.specular_k)
+        else:
+            blinn = blinn ** self.sphere_specular_k[object_index][:, None]
+        color += specular * (blinn @ self.light_colors)
 
         return color
 
+    @staticmethod
+    def bg_color(directions):
+        xp = _array_module(directions)
+        t = directions[..., 1:2] / xp.linalg.norm(directions, axis=-1, keepdims=True)
+        return t*xp.asarray(WHITE.rgb) + (1-t)*xp.asarray(BLACK.rgb)
+
 
 class Image:
     """Simple image class"""
@@ -271,10 +761,22 @@ class Image:
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        self.pixels = [[None for x in range(width)] for y in range(height)]
+        self.pixels = np.zeros((height, width, 3), dtype=np.uint8)
 
     def set_pixel(self, x, y, color):
-        self.pixels[y][x] = color
+        self.pixels[y, x] = self.to_bytes(color.rgb)
+
+    def set_pixels(self, colors):
+        """Sets every pixel at once from a (height, width, 3) NumPy or CuPy array of floats"""
+        pixels = self.to_bytes(colors)
+        # Quantize on the GPU, only the bytes are copied back
+        self.pixels[:] = pixels if _array_module(pixels) is np else cupy.asnumpy(pixels)
+
+    @staticmethod
+    def to_bytes(colors):
+        """Converts floats between 0 and 1 into ints between 0 and 255"""
+        xp = _array_module(colors)
+        return xp.clip(xp.rint(colors * 255), 0, 255).astype(np.uint8)
 
     def write_ppm(self, ppm_file_path=None):
         # Define auxiliary functions
@@ -288,23 +790,15 @@ class Image:
 
             return parser.parse_args().Image
 
-        def to_byte(color):
-            """Converts floats between 0 and 1 into ints between 0 and 255"""
-            return [int(max(min(round(val * 255), 255), 0)) for val in color.rgb]
-
         if ppm_file_path == None:
             ppm_file_path = get_path()
 
         if ppm_file_path.endswith('.ppm'):
-            with open(ppm_file_path, 'w') as ppm_file:
-                # Write the header
-                ppm_file.write(f'P3 {self.width} {self.height}\n255\n')
-                # Write the image pixels
-                for row in self.pixels:
-                    for color in row:
-                        r, g, b = to_byte(color)
-                        ppm_file.write(f'{r:3} {g:3} {b:3}\t')
-                    ppm_file.write('\n')
+            with open(ppm_file_path, 'wb') as ppm_file:
+                # Write the header of a binary (P6) ppm
+                ppm_file.write(f'P6\n{self.width} {self.height}\n255\n'.encode())
+                # Write the image pixels as raw bytes
+                self.pixels.tofile(ppm_file)
         else:
             raise SyntaxError('Image must be a ppm file.')
 